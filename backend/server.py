@@ -1,14 +1,21 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Header
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError, ServerSelectionTimeoutError, WriteError
 import os
 import logging
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
 import uuid
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from enum import Enum
 
 ROOT_DIR = Path(__file__).parent
@@ -57,6 +64,7 @@ class FeedbackStats(BaseModel):
     category_breakdown: dict
     rating_distribution: dict
     recent_feedback: List[Feedback]
+    avg_sentiment: float = 0.0
 
 # Simple sentiment analysis function (can be enhanced with AI)
 def analyze_sentiment(text: str) -> float:
@@ -73,29 +81,552 @@ def analyze_sentiment(text: str) -> float:
     
     return (positive_count - negative_count) / (positive_count + negative_count)
 
-# Routes
-@api_router.get("/")
-async def root():
-    return {"message": "Customer Feedback Portal API"}
+# Pre-aggregated stats cube: one cell per (category, rating, day) holding
+# count, rating_sum and sentiment_sum, so any slice is a sum over cells.
+def feedback_day(timestamp: datetime) -> str:
+    """Day bucket (UTC, YYYY-MM-DD) a feedback timestamp falls into"""
+    return timestamp.strftime('%Y-%m-%d')
 
-@api_router.post("/feedback", response_model=Feedback)
-async def create_feedback(feedback_data: FeedbackCreate):
-    """Create a new feedback entry with sentiment analysis"""
+def cube_cell_key(feedback: dict) -> dict:
+    """Cube coordinates of a stored feedback document"""
+    category = feedback['category']
+    return {
+        'category': category.value if isinstance(category, FeedbackCategory) else category,
+        'rating': feedback['rating'],
+        'day': feedback_day(feedback['timestamp'])
+    }
+
+def cube_cell_delta(feedback: dict, sign: int = 1) -> dict:
+    """$inc document adding (sign=1) or removing (sign=-1) a feedback from its cell"""
+    return {
+        'count': sign,
+        'rating_sum': sign * feedback['rating'],
+        'sentiment_sum': sign * (feedback.get('sentiment_score') or 0)
+    }
+
+def build_cube_cells(feedback_docs: Iterable[dict]) -> List[dict]:
+    """Fold feedback documents into cube cells"""
+    cells = {}
+    for feedback in feedback_docs:
+        key = cube_cell_key(feedback)
+        cell = cells.setdefault(
+            (key['category'], key['rating'], key['day']),
+            {**key, 'count': 0, 'rating_sum': 0, 'sentiment_sum': 0.0}
+        )
+        for field, value in cube_cell_delta(feedback).items():
+            cell[field] += value
+    return list(cells.values())
+
+def cube_slice_query(categories: Optional[List[FeedbackCategory]] = None,
+                     ratings: Optional[List[int]] = None,
+                     from_day: Optional[date] = None,
+                     to_day: Optional[date] = None) -> dict:
+    """Mongo filter selecting the cube cells of a slice (days inclusive)"""
+    query = {}
+    if categories:
+        query['category'] = {'$in': [c.value for c in categories]}
+    if ratings:
+        query['rating'] = {'$in': ratings}
+    if from_day or to_day:
+        query['day'] = {}
+        if from_day:
+            query['day']['$gte'] = from_day.isoformat()
+        if to_day:
+            query['day']['$lte'] = to_day.isoformat()
+    return query
+
+def feedback_slice_query(categories: Optional[List[FeedbackCategory]] = None,
+                         ratings: Optional[List[int]] = None,
+                         from_day: Optional[date] = None,
+                         to_day: Optional[date] = None) -> dict:
+    """Mongo filter selecting the feedback documents of the same slice"""
+    query = {}
+    if categories:
+        query['category'] = {'$in': [c.value for c in categories]}
+    if ratings:
+        query['rating'] = {'$in': ratings}
+    if from_day or to_day:
+        query['timestamp'] = {}
+        if from_day:
+            query['timestamp']['$gte'] = datetime.combine(from_day, datetime.min.time())
+        if to_day:
+            query['timestamp']['$lt'] = datetime.combine(to_day + timedelta(days=1), datetime.min.time())
+    return query
+
+def summarize_cube_cells(cells: Iterable[dict]) -> dict:
+    """Sum cube cells into the aggregate fields of FeedbackStats"""
+    total_feedback = 0
+    rating_sum = 0
+    sentiment_sum = 0.0
+    categories = {}
+    rating_distribution = {str(rating): 0 for rating in range(1, 6)}
+
+    for cell in cells:
+        if cell['count'] <= 0:
+            continue
+        total_feedback += cell['count']
+        rating_sum += cell['rating_sum']
+        sentiment_sum += cell['sentiment_sum']
+        totals = categories.setdefault(cell['category'], [0, 0, 0.0])
+        totals[0] += cell['count']
+        totals[1] += cell['rating_sum']
+        totals[2] += cell['sentiment_sum']
+        rating_distribution[str(cell['rating'])] = rating_distribution.get(str(cell['rating']), 0) + cell['count']
+
+    if total_feedback == 0:
+        return {
+            'total_feedback': 0,
+            'avg_rating': 0.0,
+            'avg_sentiment': 0.0,
+            'category_breakdown': {},
+            'rating_distribution': {}
+        }
+
+    # Keep the enum order used by the frontend
+    category_breakdown = {}
+    for category in FeedbackCategory:
+        if category.value in categories:
+            count, category_rating_sum, category_sentiment_sum = categories[category.value]
+            category_breakdown[category.value] = {
+                'count': count,
+                'avg_rating': category_rating_sum / count,
+                'avg_sentiment': category_sentiment_sum / count
+            }
+
+    return {
+        'total_feedback': total_feedback,
+        'avg_rating': rating_sum / total_feedback,
+        'avg_sentiment': sentiment_sum / total_feedback,
+        'category_breakdown': category_breakdown,
+        'rating_distribution': rating_distribution
+    }
+
+async def update_feedback_cube(feedback: dict, sign: int = 1):
+    """Apply a single feedback insert (sign=1) or delete (sign=-1) to the cube"""
+    key = cube_cell_key(feedback)
+    # version lets refresh_cube_cells detect increments that land mid-recount
+    delta = {**cube_cell_delta(feedback, sign), 'version': 1}
+    await db.feedback_cube.update_one(key, {'$inc': delta}, upsert=True)
+    if sign < 0:
+        await db.feedback_cube.delete_one({**key, 'count': {'$lte': 0}})
+
+CUBE_REBUILD_HINT = "run POST /api/feedback/stats/rebuild or restart the backend to repair it"
+
+async def mark_cube_stale():
+    """Flag the cube as out of sync so the next startup rebuilds it"""
+    try:
+        await db.feedback_cube_state.update_one({'_id': 'cube'}, {'$set': {'stale': True}}, upsert=True)
+    except PyMongoError:
+        logger.exception("Could not flag the feedback stats cube as stale")
+
+async def apply_feedback_to_cube(feedback: dict, sign: int = 1):
+    """Best-effort cube update for an already stored or deleted feedback"""
+    try:
+        await update_feedback_cube(feedback, sign)
+        # A delete of feedback the running rebuild already read is lost with the old cube
+        if sign < 0 and await db.feedback_cube_state.find_one({'_id': 'rebuild_lock'}):
+            logger.warning(f"Feedback {feedback['id']} was deleted during a stats rebuild; {CUBE_REBUILD_HINT}")
+            await mark_cube_stale()
+    except Exception:
+        logger.exception(f"Stats cube update failed for feedback {feedback['id']}; {CUBE_REBUILD_HINT}")
+        await mark_cube_stale()
+
+CUBE_KEY_INDEX = [('category', 1), ('rating', 1), ('day', 1)]
+CUBE_PROJECTION = {'_id': 0, 'category': 1, 'rating': 1, 'timestamp': 1, 'sentiment_score': 1}
+CUBE_REBUILD_LOCK_SECONDS = 60
+CUBE_REBUILD_CATCHUP_SECONDS = 60
+CUBE_REFRESH_ATTEMPTS = 5
+
+# Server-side equivalent of build_cube_cells
+CUBE_REBUILD_PIPELINE = [
+    {'$group': {
+        '_id': {
+            'category': '$category',
+            'rating': '$rating',
+            'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}}
+        },
+        'count': {'$sum': 1},
+        'rating_sum': {'$sum': '$rating'},
+        'sentiment_sum': {'$sum': {'$ifNull': ['$sentiment_score', 0]}}
+    }},
+    {'$project': {
+        '_id': 0,
+        'category': '$_id.category',
+        'rating': '$_id.rating',
+        'day': '$_id.day',
+        'count': 1,
+        'rating_sum': 1,
+        'sentiment_sum': 1
+    }}
+]
+
+async def acquire_cube_rebuild_lock() -> Optional[str]:
+    """Take the cluster-wide rebuild lock; None if another worker holds it"""
+    now = datetime.utcnow()
+    owner = str(uuid.uuid4())
+    try:
+        # Matches a missing or expired lock; a live lock makes the upsert collide on _id
+        await db.feedback_cube_state.update_one(
+            {'_id': 'rebuild_lock', 'expires_at': {'$lt': now}},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=CUBE_REBUILD_LOCK_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None
+    return owner
+
+async def renew_cube_rebuild_lock(owner: str):
+    """Keep the rebuild lock alive for as long as the rebuild runs"""
+    while True:
+        await asyncio.sleep(CUBE_REBUILD_LOCK_SECONDS / 3)
+        try:
+            result = await db.feedback_cube_state.update_one(
+                {'_id': 'rebuild_lock', 'owner': owner},
+                {'$set': {'expires_at': datetime.utcnow() + timedelta(seconds=CUBE_REBUILD_LOCK_SECONDS)}}
+            )
+        except PyMongoError:
+            logger.exception("Could not renew the feedback stats rebuild lock")
+            continue
+        if result.matched_count == 0:
+            logger.warning("Lost the feedback stats rebuild lock to another worker")
+            return
+
+async def refresh_cube_cell(key: dict) -> bool:
+    """Recompute one cell from the feedback collection.
+
+    The write only applies if no increment touched the cell since it was
+    read; returns False on such a conflict.
+    """
+    current = await db.feedback_cube.find_one(key, {'version': 1}) or {}
+    version = current.get('version')
+    day_start = datetime.strptime(key['day'], '%Y-%m-%d')
+    feedback_docs = await db.feedback.find({
+        'category': key['category'],
+        'rating': key['rating'],
+        'timestamp': {'$gte': day_start, '$lt': day_start + timedelta(days=1)}
+    }, CUBE_PROJECTION).to_list(None)
+    cells = build_cube_cells(feedback_docs)
+    # Missing and rebuilt cells have no version, which {'version': None} matches
+    guard = {**key, 'version': version}
+    if not cells:
+        if not current:
+            return True
+        result = await db.feedback_cube.delete_one(guard)
+        return result.deleted_count == 1
+    try:
+        result = await db.feedback_cube.replace_one(guard, {**cells[0], 'version': (version or 0) + 1}, upsert=True)
+    except DuplicateKeyError:
+        # An increment created or bumped the cell first
+        return False
+    return result.matched_count == 1 or result.upserted_id is not None
+
+async def refresh_cube_cells(keys: Iterable[dict]):
+    """Recompute the given cells, retrying those changed by concurrent increments"""
+    for key in keys:
+        for _ in range(CUBE_REFRESH_ATTEMPTS):
+            if await refresh_cube_cell(key):
+                break
+        else:
+            logger.warning(f"Stats cube cell {key} kept changing during a recount; {CUBE_REBUILD_HINT}")
+            await mark_cube_stale()
+
+async def rebuild_feedback_cube() -> Optional[int]:
+    """Regenerate the whole cube from the feedback collection.
+
+    Cells are aggregated by the database into a staging collection that is
+    renamed over the live one, so readers never see a partial cube. Returns
+    None when another worker is already rebuilding.
+    """
+    lock_owner = await acquire_cube_rebuild_lock()
+    if lock_owner is None:
+        return None
+    heartbeat = asyncio.ensure_future(renew_cube_rebuild_lock(lock_owner))
+    staging = db[f'feedback_cube_rebuild_{uuid.uuid4().hex}']
+    try:
+        # Drift flagged from here on is not covered by this rebuild's snapshot
+        await db.feedback_cube_state.update_one({'_id': 'cube'}, {'$set': {'stale': False}}, upsert=True)
+        started_at = datetime.utcnow()
+
+        await db.feedback.aggregate(CUBE_REBUILD_PIPELINE + [{'$out': staging.name}]).to_list(None)
+        await staging.create_index(CUBE_KEY_INDEX, unique=True)
+        cell_count = await staging.count_documents({})
+        await staging.rename('feedback_cube', dropTarget=True)
+
+        # Feedback stored while the snapshot was read only reached the old cube
+        recent = await db.feedback.find(
+            {'timestamp': {'$gte': started_at - timedelta(seconds=CUBE_REBUILD_CATCHUP_SECONDS)}},
+            CUBE_PROJECTION
+        ).to_list(None)
+        touched = {tuple(cube_cell_key(f).values()): cube_cell_key(f) for f in recent}
+        await refresh_cube_cells(touched.values())
+        return cell_count
+    except BaseException:
+        # Only a completed rebuild may leave the stale flag cleared
+        try:
+            await staging.drop()
+        except PyMongoError:
+            logger.exception(f"Could not drop stats cube staging collection {staging.name}")
+        await mark_cube_stale()
+        raise
+    finally:
+        heartbeat.cancel()
+        try:
+            await db.feedback_cube_state.delete_one({'_id': 'rebuild_lock', 'owner': lock_owner})
+        except PyMongoError:
+            logger.exception("Could not release the feedback stats rebuild lock; it expires on its own")
+
+# Idempotent submissions: a retried POST /feedback returns the original
+# Feedback instead of inserting a duplicate. Requests are keyed by the
+# Idempotency-Key header, or by a content hash within a time window.
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_WINDOW_SECONDS = 5 * 60
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_WAIT_SECONDS = 5.0
+IDEMPOTENCY_POLL_SECONDS = 0.05
+IDEMPOTENCY_LEASE_SECONDS = 10
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+class FeedbackNotStored(Exception):
+    """The feedback write definitely did not happen, so its claim can be released"""
+
+class IdempotencyCache:
+    """In-process LRU of recent submissions with a per-entry TTL"""
+    def __init__(self, max_size: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if self.clock() > expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (self.clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+def feedback_request_hash(feedback_data: FeedbackCreate) -> str:
+    """Fingerprint of the full request body, used to reject reused keys"""
+    body = json.dumps(feedback_data.dict(), sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def content_idempotency_key(feedback_data: FeedbackCreate) -> str:
+    """Fallback key from email, category and comment.
+
+    The time window is not part of the key; it is measured from the first
+    submission's claim, so retries straddling a clock boundary still match.
+    """
+    content = '\x1f'.join([
+        feedback_data.customer_email.strip().lower(),
+        feedback_data.category.value,
+        feedback_data.comment.strip()
+    ])
+    return 'content:' + hashlib.sha256(content.encode()).hexdigest()
+
+def mongo_utcnow() -> datetime:
+    """Current UTC time at the millisecond precision Mongo stores"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+class SubmissionDeduplicator:
+    """Creates each submission at most once per key.
+
+    Claims in the feedback_idempotency collection deduplicate across
+    workers; the in-process cache and pending map spare this worker the
+    round trips for retries and concurrent identical requests.
+    """
+    def __init__(self, cache: IdempotencyCache):
+        self.cache = cache
+        self.pending = {}
+
+    async def submit(self, key: str, request_hash: Optional[str],
+                     create: Callable[[str], Awaitable[Feedback]],
+                     window_seconds: Optional[float] = None) -> Feedback:
+        """Run create at most once per key; concurrent and later retries share its result.
+
+        With window_seconds, a key only deduplicates for that long after the
+        first submission; later ones create a new feedback. A key keeps
+        answering with its original feedback even after that was deleted.
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            # Only identical requests share a pending claim, so one caller's
+            # rejected body never fails another's
+            pending_key = (key, request_hash)
+            pending = self.pending.get(pending_key)
+            if pending is None:
+                pending = asyncio.ensure_future(self._claim_and_create(key, request_hash, create, window_seconds))
+                self.pending[pending_key] = pending
+                pending.add_done_callback(lambda _: self.pending.pop(pending_key, None))
+            # Shield so a disconnecting client does not cancel the shared insert
+            entry = await asyncio.shield(pending)
+
+        stored_hash, feedback = entry
+        if request_hash and stored_hash and request_hash != stored_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        return feedback
+
+    async def _claim_and_create(self, key: str, request_hash: Optional[str],
+                                create: Callable[[str], Awaitable[Feedback]],
+                                window_seconds: Optional[float]) -> Tuple[Optional[str], Feedback]:
+        """Claim the key in Mongo and create the feedback, or wait for the worker that claimed it"""
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            now = mongo_utcnow()
+            claim = {
+                '_id': key,
+                'feedback_id': str(uuid.uuid4()),
+                'request_hash': request_hash,
+                'created_at': now,
+                'claimed_at': now
+            }
+            try:
+                await db.feedback_idempotency.insert_one(claim)
+            except DuplicateKeyError:
+                existing = await db.feedback_idempotency.find_one({'_id': key})
+            else:
+                return await self._create_claimed(claim, create, window_seconds)
+
+            if existing is None:
+                # Released by a worker whose insert failed; claim it ourselves
+                continue
+            if request_hash and existing.get('request_hash') and request_hash != existing['request_hash']:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+
+            stored = existing.get('feedback')
+            if stored is None:
+                # The owner has not recorded its result yet, or failed to
+                stored = await db.feedback.find_one({'id': existing['feedback_id']})
+            window_left = None
+            if window_seconds is not None:
+                window_left = window_seconds - (now - existing['created_at']).total_seconds()
+            if stored and (window_left is None or window_left > 0):
+                entry = (existing.get('request_hash'), Feedback(**stored))
+                self.cache.set(key, entry, window_left)
+                return entry
+
+            if stored:
+                # The window of the earlier submission is over; start a new one
+                taken = await db.feedback_idempotency.find_one_and_update(
+                    {'_id': key, 'feedback_id': existing['feedback_id']},
+                    {'$set': {k: v for k, v in claim.items() if k != '_id'}, '$unset': {'feedback': ''}},
+                    return_document=ReturnDocument.AFTER
+                )
+                if taken is not None:
+                    return await self._create_claimed(taken, create, window_seconds)
+                continue
+
+            claimed_at = existing.get('claimed_at') or existing['created_at']
+            if claimed_at < now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS):
+                # The owner never stored its feedback (e.g. it crashed); take the claim
+                # over. The feedback id is kept, so a late write of the owner collides
+                # with ours on the unique feedback id instead of duplicating it.
+                taken = await db.feedback_idempotency.find_one_and_update(
+                    {'_id': key, 'claimed_at': existing.get('claimed_at')},
+                    {'$set': {'claimed_at': now, 'request_hash': request_hash or existing.get('request_hash')}},
+                    return_document=ReturnDocument.AFTER
+                )
+                if taken is not None:
+                    return await self._create_claimed(taken, create, window_seconds)
+
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="A request with this idempotency key is still in progress")
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    async def _create_claimed(self, claim: dict, create: Callable[[str], Awaitable[Feedback]],
+                              window_seconds: Optional[float]) -> Tuple[Optional[str], Feedback]:
+        try:
+            feedback = await create(claim['feedback_id'])
+        except FeedbackNotStored:
+            # Only release when nothing was written; any other failure keeps the
+            # claim and the lease lets a retry take it over
+            try:
+                await db.feedback_idempotency.delete_one({'_id': claim['_id'], 'claimed_at': claim['claimed_at']})
+            except PyMongoError:
+                logger.exception(f"Could not release idempotency claim {claim['_id']}")
+            raise HTTPException(status_code=500, detail="Failed to create feedback")
+
+        # Keep the result with the claim so retries get it without a feedback
+        # lookup, and still get it after the feedback was deleted
+        try:
+            await db.feedback_idempotency.update_one(
+                {'_id': claim['_id'], 'feedback_id': claim['feedback_id']},
+                {'$set': {'feedback': feedback.dict()}}
+            )
+        except PyMongoError:
+            logger.exception(f"Could not record the result of idempotency claim {claim['_id']}")
+
+        entry = (claim['request_hash'], feedback)
+        self.cache.set(claim['_id'], entry, window_seconds)
+        return entry
+
+def submission_identity(feedback_data: FeedbackCreate,
+                        idempotency_key: Optional[str]) -> Tuple[str, Optional[str], Optional[float]]:
+    """Deduplication key, request hash and window of a POST /feedback request"""
+    if idempotency_key is not None:
+        if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key header")
+        return f"key:{idempotency_key}", feedback_request_hash(feedback_data), None
+    return content_idempotency_key(feedback_data), None, IDEMPOTENCY_WINDOW_SECONDS
+
+submission_deduplicator = SubmissionDeduplicator(IdempotencyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS))
+
+async def insert_feedback(feedback_data: FeedbackCreate, feedback_id: str) -> Feedback:
+    """Run sentiment analysis and store a new feedback entry under a claimed id"""
     feedback_dict = feedback_data.dict()
     
     # Add sentiment analysis
     sentiment_score = analyze_sentiment(feedback_dict['comment'])
     feedback_dict['sentiment_score'] = sentiment_score
     
-    feedback_obj = Feedback(**feedback_dict)
+    feedback_obj = Feedback(id=feedback_id, **feedback_dict)
     
     # Insert into database
-    result = await db.feedback.insert_one(feedback_obj.dict())
-    if not result.inserted_id:
-        raise HTTPException(status_code=500, detail="Failed to create feedback")
+    try:
+        await db.feedback.insert_one(feedback_obj.dict())
+    except DuplicateKeyError:
+        # An earlier attempt under this claim was stored after all
+        stored = await db.feedback.find_one({'id': feedback_id})
+        if stored is None:
+            raise FeedbackNotStored(feedback_id)
+        return Feedback(**stored)
+    except (ServerSelectionTimeoutError, WriteError) as error:
+        # The write never reached a server, or the server rejected it
+        raise FeedbackNotStored(feedback_id) from error
+    
+    await apply_feedback_to_cube(feedback_obj.dict())
     
     return feedback_obj
 
+# Routes
+@api_router.get("/")
+async def root():
+    return {"message": "Customer Feedback Portal API"}
+
+@api_router.post("/feedback", response_model=Feedback)
+async def create_feedback(
+    feedback_data: FeedbackCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Create a new feedback entry with sentiment analysis; retries return the original entry"""
+    key, request_hash, window_seconds = submission_identity(feedback_data, idempotency_key)
+    return await submission_deduplicator.submit(
+        key, request_hash, lambda feedback_id: insert_feedback(feedback_data, feedback_id), window_seconds
+    )
+
 @api_router.get("/feedback", response_model=List[Feedback])
 async def get_all_feedback():
     """Get all feedback entries"""
@@ -103,53 +634,40 @@ async def get_all_feedback():
     return [Feedback(**feedback) for feedback in feedback_list]
 
 @api_router.get("/feedback/stats", response_model=FeedbackStats)
-async def get_feedback_stats():
-    """Get comprehensive feedback statistics for 3D visualization"""
-    # Get all feedback
-    all_feedback = await db.feedback.find().to_list(1000)
+async def get_feedback_stats(
+    category: Optional[List[FeedbackCategory]] = Query(None),
+    rating: Optional[List[int]] = Query(None),
+    from_day: Optional[date] = Query(None, alias="from"),
+    to_day: Optional[date] = Query(None, alias="to")
+):
+    """Get feedback statistics for 3D visualization, optionally sliced by category, rating and day range"""
+    if from_day and to_day and from_day > to_day:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
     
-    if not all_feedback:
-        return FeedbackStats(
-            total_feedback=0,
-            avg_rating=0.0,
-            category_breakdown={},
-            rating_distribution={},
-            recent_feedback=[]
-        )
+    # Aggregates come from the pre-aggregated cube
+    cells = await db.feedback_cube.find(
+        cube_slice_query(category, rating, from_day, to_day), {'_id': 0}
+    ).to_list(None)
+    summary = summarize_cube_cells(cells)
     
-    feedback_objects = [Feedback(**feedback) for feedback in all_feedback]
+    if summary['total_feedback'] == 0:
+        return FeedbackStats(recent_feedback=[], **summary)
     
-    # Calculate statistics
-    total_feedback = len(feedback_objects)
-    avg_rating = sum(f.rating for f in feedback_objects) / total_feedback
+    # Recent feedback (last 10) within the slice
+    recent_list = await db.feedback.find(
+        feedback_slice_query(category, rating, from_day, to_day)
+    ).sort("timestamp", -1).limit(10).to_list(10)
+    recent_feedback = [Feedback(**feedback) for feedback in recent_list]
     
-    # Category breakdown
-    category_breakdown = {}
-    for category in FeedbackCategory:
-        category_feedback = [f for f in feedback_objects if f.category == category]
-        if category_feedback:
-            category_breakdown[category.value] = {
-                'count': len(category_feedback),
-                'avg_rating': sum(f.rating for f in category_feedback) / len(category_feedback),
-                'avg_sentiment': sum(f.sentiment_score or 0 for f in category_feedback) / len(category_feedback)
-            }
-    
-    # Rating distribution
-    rating_distribution = {}
-    for rating in range(1, 6):
-        count = len([f for f in feedback_objects if f.rating == rating])
-        rating_distribution[str(rating)] = count
-    
-    # Recent feedback (last 10)
-    recent_feedback = sorted(feedback_objects, key=lambda x: x.timestamp, reverse=True)[:10]
-    
-    return FeedbackStats(
-        total_feedback=total_feedback,
-        avg_rating=avg_rating,
-        category_breakdown=category_breakdown,
-        rating_distribution=rating_distribution,
-        recent_feedback=recent_feedback
-    )
+    return FeedbackStats(recent_feedback=recent_feedback, **summary)
+
+@api_router.post("/feedback/stats/rebuild")
+async def rebuild_feedback_stats():
+    """Regenerate the stats cube from stored feedback"""
+    cell_count = await rebuild_feedback_cube()
+    if cell_count is None:
+        raise HTTPException(status_code=409, detail="A stats rebuild is already in progress")
+    return {"message": "Feedback stats rebuilt successfully", "cells": cell_count}
 
 @api_router.get("/feedback/category/{category}")
 async def get_feedback_by_category(category: FeedbackCategory):
@@ -160,9 +678,11 @@ async def get_feedback_by_category(category: FeedbackCategory):
 @api_router.delete("/feedback/{feedback_id}")
 async def delete_feedback(feedback_id: str):
     """Delete a feedback entry"""
-    result = await db.feedback.delete_one({"id": feedback_id})
-    if result.deleted_count == 0:
+    feedback = await db.feedback.find_one_and_delete({"id": feedback_id})
+    if feedback is None:
         raise HTTPException(status_code=404, detail="Feedback not found")
+    
+    await apply_feedback_to_cube(feedback, sign=-1)
     return {"message": "Feedback deleted successfully"}
 
 # Include the router in the main app
@@ -183,6 +703,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def init_collections():
+    await db.feedback_cube.create_index(CUBE_KEY_INDEX, unique=True)
+    await db.feedback.create_index([("timestamp", -1)])
+    # Unique ids let a retried insert under the same claim detect an earlier write
+    await db.feedback.create_index("id", unique=True)
+    await db.feedback_idempotency.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    # Cube is derived data; regenerate it if it was never built or a cube
+    # update failed. Only the worker that gets the rebuild lock does it, and
+    # a failure is logged rather than keeping the API from starting.
+    try:
+        cube_state = await db.feedback_cube_state.find_one({'_id': 'cube'}) or {}
+        if cube_state.get('stale') or await db.feedback_cube.estimated_document_count() == 0:
+            cell_count = await rebuild_feedback_cube()
+            if cell_count is not None:
+                logger.info(f"Built feedback stats cube with {cell_count} cells")
+    except Exception:
+        logger.exception(f"Feedback stats cube rebuild failed at startup; {CUBE_REBUILD_HINT}")
+        await mark_cube_stale()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
@@ -6,6 +6,18 @@ import axios from 'axios';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost)
+const createSubmissionKey = () => {
+  if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+    return window.crypto.randomUUID();
+  }
+  if (window.crypto && typeof window.crypto.getRandomValues === 'function') {
+    const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+};
+
 const FeedbackPortal = () => {
   const [activeView, setActiveView] = useState('dashboard');
   const [feedbackData, setFeedbackData] = useState([]);
@@ -21,6 +33,7 @@ const FeedbackPortal = () => {
   const sceneRef = useRef();
   const rendererRef = useRef();
   const animationRef = useRef();
+  const submissionKeyRef = useRef(null);
 
   // Fetch data
   const fetchFeedbackData = async () => {
@@ -36,13 +49,24 @@ const FeedbackPortal = () => {
     }
   };
 
+  // A new idempotency key is needed once the form content changes
+  useEffect(() => {
+    submissionKeyRef.current = null;
+  }, [formData]);
+
   // Submit feedback
   const handleSubmitFeedback = async (e) => {
     e.preventDefault();
     setIsSubmitting(true);
     
     try {
-      await axios.post(`${API}/feedback`, formData);
+      // Retries of the same submission reuse its key so the backend stores it once
+      if (!submissionKeyRef.current) {
+        submissionKeyRef.current = createSubmissionKey();
+      }
+      await axios.post(`${API}/feedback`, formData, {
+        headers: { 'Idempotency-Key': submissionKeyRef.current }
+      });
       setFormData({
         customer_name: '',
         customer_email: '',
@@ -0,0 +1,71 @@
+"""
+Shared fixtures for tests that drive the real server functions against a database.
+
+The MongoDB configured in backend/.env is used when it is reachable;
+otherwise the same scenarios run against an in-memory mongomock database.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+def mongo_available():
+    try:
+        MongoClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+USE_REAL_MONGO = mongo_available()
+
+
+def pytest_report_header(config):
+    backend = os.environ["MONGO_URL"] if USE_REAL_MONGO else "mongomock (MongoDB not reachable)"
+    return f"database tests: {backend}"
+
+
+def make_worker():
+    """Deduplication state of a fresh backend worker process"""
+    return server.SubmissionDeduplicator(server.IdempotencyCache(1000, 60))
+
+
+@pytest.fixture
+def new_worker():
+    return make_worker
+
+
+@pytest.fixture
+def server_db(monkeypatch):
+    """Run an async scenario with the server wired to a throwaway database"""
+    db_name = f"{os.environ['DB_NAME']}_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(server, "submission_deduplicator", make_worker())
+
+    def run(scenario):
+        async def main():
+            # Motor clients are bound to the event loop they are created in
+            client = AsyncIOMotorClient(os.environ["MONGO_URL"]) if USE_REAL_MONGO else AsyncMongoMockClient()
+            monkeypatch.setattr(server, "db", client[db_name])
+            try:
+                await server.init_collections()
+                return await scenario(client[db_name])
+            finally:
+                await client.drop_database(db_name)
+                client.close()
+
+        return asyncio.run(main())
+
+    return run
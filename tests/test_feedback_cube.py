@@ -0,0 +1,452 @@
+"""
+Stats cube tests: every slice answered from the pre-aggregated cube
+must match a brute-force scan of the raw feedback documents.
+"""
+
+import asyncio
+import random
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from server import (  # noqa: E402
+    FeedbackCategory,
+    FeedbackCreate,
+    analyze_sentiment,
+    build_cube_cells,
+    cube_cell_delta,
+    cube_cell_key,
+    cube_slice_query,
+    feedback_slice_query,
+    summarize_cube_cells,
+)
+
+START = datetime(2024, 1, 1)
+DAYS = 60
+COMMENTS = [
+    "Great product, I love it",
+    "Terrible support, really bad",
+    "It was fine",
+    "Amazing service but poor packaging",
+    "Worst experience, useless and awful",
+]
+
+
+def make_feedback(rng, count=2000):
+    docs = []
+    for _ in range(count):
+        comment = rng.choice(COMMENTS)
+        docs.append({
+            "id": str(uuid.uuid4()),
+            "customer_name": "Cube Tester",
+            "customer_email": f"cube.tester.{len(docs)}@email.com",
+            "additional_data": {},
+            "category": rng.choice(list(FeedbackCategory)).value,
+            "rating": rng.randint(1, 5),
+            "comment": comment,
+            "timestamp": START + timedelta(seconds=rng.randrange(DAYS * 86400)),
+            "sentiment_score": analyze_sentiment(comment),
+        })
+    return docs
+
+
+def brute_force_stats(docs, categories=None, ratings=None, from_day=None, to_day=None):
+    """Reference implementation mirroring the original full-scan stats"""
+    selected = [
+        d for d in docs
+        if (not categories or d["category"] in [c.value for c in categories])
+        and (not ratings or d["rating"] in ratings)
+        and (not from_day or d["timestamp"].date() >= from_day)
+        and (not to_day or d["timestamp"].date() <= to_day)
+    ]
+    if not selected:
+        return {
+            "total_feedback": 0,
+            "avg_rating": 0.0,
+            "avg_sentiment": 0.0,
+            "category_breakdown": {},
+            "rating_distribution": {},
+        }
+
+    category_breakdown = {}
+    for category in FeedbackCategory:
+        category_docs = [d for d in selected if d["category"] == category.value]
+        if category_docs:
+            category_breakdown[category.value] = {
+                "count": len(category_docs),
+                "avg_rating": sum(d["rating"] for d in category_docs) / len(category_docs),
+                "avg_sentiment": sum(d["sentiment_score"] or 0 for d in category_docs) / len(category_docs),
+            }
+
+    return {
+        "total_feedback": len(selected),
+        "avg_rating": sum(d["rating"] for d in selected) / len(selected),
+        "avg_sentiment": sum(d["sentiment_score"] or 0 for d in selected) / len(selected),
+        "category_breakdown": category_breakdown,
+        "rating_distribution": {
+            str(rating): len([d for d in selected if d["rating"] == rating]) for rating in range(1, 6)
+        },
+    }
+
+
+def cube_slice(cells, categories=None, ratings=None, from_day=None, to_day=None):
+    """Select cube cells the way cube_slice_query asks Mongo to"""
+    query = cube_slice_query(categories, ratings, from_day, to_day)
+
+    def matches(cell):
+        for field, condition in query.items():
+            value = cell[field]
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$gte" in condition and value < condition["$gte"]:
+                return False
+            if "$lte" in condition and value > condition["$lte"]:
+                return False
+        return True
+
+    return [cell for cell in cells if matches(cell)]
+
+
+def random_slice(rng):
+    categories = rng.sample(list(FeedbackCategory), rng.randint(0, 4)) or None
+    ratings = rng.sample(range(1, 6), rng.randint(0, 5)) or None
+    from_day = START.date() + timedelta(days=rng.randrange(-5, DAYS)) if rng.random() < 0.7 else None
+    to_day = from_day + timedelta(days=rng.randrange(0, 30)) if from_day and rng.random() < 0.7 else None
+    return categories, ratings, from_day, to_day
+
+
+def assert_stats_equal(actual, expected):
+    assert actual["total_feedback"] == expected["total_feedback"]
+    assert actual["avg_rating"] == pytest.approx(expected["avg_rating"])
+    assert actual["avg_sentiment"] == pytest.approx(expected["avg_sentiment"])
+    assert actual["rating_distribution"] == expected["rating_distribution"]
+    assert list(actual["category_breakdown"]) == list(expected["category_breakdown"])
+    for category, breakdown in expected["category_breakdown"].items():
+        assert actual["category_breakdown"][category] == pytest.approx(breakdown)
+
+
+@pytest.fixture(scope="module")
+def docs():
+    return make_feedback(random.Random(26))
+
+
+@pytest.fixture(scope="module")
+def cells(docs):
+    return build_cube_cells(docs)
+
+
+def test_cube_is_bounded_by_dimensions(docs, cells):
+    assert len(cells) <= len(FeedbackCategory) * 5 * DAYS
+    assert sum(cell["count"] for cell in cells) == len(docs)
+
+
+def test_unfiltered_stats_match_brute_force(docs, cells):
+    assert_stats_equal(summarize_cube_cells(cells), brute_force_stats(docs))
+
+
+@pytest.mark.parametrize("categories, ratings", [
+    ([FeedbackCategory.SUPPORT], [1, 2]),
+    ([FeedbackCategory.PRODUCT, FeedbackCategory.SERVICE], None),
+    (None, [5]),
+    ([FeedbackCategory.OVERALL], [3, 4, 5]),
+])
+def test_category_rating_slices_match_brute_force(docs, cells, categories, ratings):
+    selected = cube_slice(cells, categories, ratings)
+    assert_stats_equal(summarize_cube_cells(selected), brute_force_stats(docs, categories, ratings))
+
+
+def test_random_slices_match_brute_force(docs, cells):
+    rng = random.Random(27)
+    for _ in range(200):
+        categories, ratings, from_day, to_day = random_slice(rng)
+        selected = cube_slice(cells, categories, ratings, from_day, to_day)
+        assert_stats_equal(
+            summarize_cube_cells(selected),
+            brute_force_stats(docs, categories, ratings, from_day, to_day),
+        )
+
+
+def test_empty_slice_returns_zero_stats(docs, cells):
+    future = date(2030, 1, 1)
+    selected = cube_slice(cells, from_day=future)
+    assert selected == []
+    assert_stats_equal(summarize_cube_cells(selected), brute_force_stats(docs, from_day=future))
+
+
+def test_incremental_updates_match_rebuild(docs):
+    # Replay inserts and deletes through the same $inc deltas ingestion uses
+    cube = {}
+    for doc in docs:
+        key = cube_cell_key(doc)
+        cell = cube.setdefault(tuple(key.values()), {**key, "count": 0, "rating_sum": 0, "sentiment_sum": 0.0})
+        for field, value in cube_cell_delta(doc).items():
+            cell[field] += value
+
+    removed, kept = docs[::3], [d for i, d in enumerate(docs) if i % 3]
+    for doc in removed:
+        cell = cube[tuple(cube_cell_key(doc).values())]
+        for field, value in cube_cell_delta(doc, sign=-1).items():
+            cell[field] += value
+
+    incremental = summarize_cube_cells(cube.values())
+    assert_stats_equal(incremental, summarize_cube_cells(build_cube_cells(kept)))
+    assert_stats_equal(incremental, brute_force_stats(kept))
+
+
+def test_feedback_slice_query_covers_whole_days():
+    query = feedback_slice_query(
+        [FeedbackCategory.SUPPORT], [1, 2], date(2024, 1, 1), date(2024, 1, 30)
+    )
+    assert query == {
+        "category": {"$in": ["support"]},
+        "rating": {"$in": [1, 2]},
+        "timestamp": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 31)},
+    }
+    assert cube_slice_query([FeedbackCategory.SUPPORT], [1, 2], date(2024, 1, 1), date(2024, 1, 30)) == {
+        "category": {"$in": ["support"]},
+        "rating": {"$in": [1, 2]},
+        "day": {"$gte": "2024-01-01", "$lte": "2024-01-30"},
+    }
+
+
+def test_every_cell_key_is_unique(cells):
+    keys = [(c["category"], c["rating"], c["day"]) for c in cells]
+    assert len(keys) == len(set(keys))
+    assert set(c["category"] for c in cells) <= {c.value for c in FeedbackCategory}
+    assert all(r in range(1, 6) for _, r, _ in keys)
+    assert all(isinstance(d, str) and len(d) == 10 for *_, d in keys)
+
+
+async def stored_cells(db):
+    cells = await db.feedback_cube.find({}, {"_id": 0, "version": 0}).to_list(None)
+    return sorted(cells, key=lambda c: (c["category"], c["rating"], c["day"]))
+
+
+def assert_cells_equal(actual, expected):
+    expected = sorted(expected, key=lambda c: (c["category"], c["rating"], c["day"]))
+    assert [{**c, "sentiment_sum": pytest.approx(c["sentiment_sum"])} for c in actual] == expected
+
+
+def test_stats_endpoint_matches_brute_force(server_db, docs):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs])
+        assert await server.rebuild_feedback_cube() == len(build_cube_cells(docs))
+
+        rng = random.Random(28)
+        for _ in range(50):
+            categories, ratings, from_day, to_day = random_slice(rng)
+            stats = await server.get_feedback_stats(
+                category=categories, rating=ratings, from_day=from_day, to_day=to_day
+            )
+            expected = brute_force_stats(docs, categories, ratings, from_day, to_day)
+            assert_stats_equal(stats.dict(), expected)
+
+            selected = [
+                d for d in docs
+                if (not categories or d["category"] in [c.value for c in categories])
+                and (not ratings or d["rating"] in ratings)
+                and (not from_day or d["timestamp"].date() >= from_day)
+                and (not to_day or d["timestamp"].date() <= to_day)
+            ]
+            recent = sorted((d["timestamp"] for d in selected), reverse=True)[:10]
+            assert [f.timestamp for f in stats.recent_feedback] == recent
+
+    server_db(scenario)
+
+
+def test_ingestion_and_deletes_keep_cube_in_sync(server_db):
+    async def scenario(db):
+        rng = random.Random(29)
+        created = []
+        for i in range(60):
+            created.append(await server.create_feedback(FeedbackCreate(
+                customer_name="Cube Tester",
+                customer_email=f"cube.sync.{i}@email.com",
+                category=rng.choice(list(FeedbackCategory)),
+                rating=rng.randint(1, 5),
+                comment=rng.choice(COMMENTS),
+            ), idempotency_key=None))
+        for feedback in created[::2]:
+            await server.delete_feedback(feedback.id)
+
+        remaining = await db.feedback.find().to_list(None)
+        assert len(remaining) == 30
+        cells = await stored_cells(db)
+        assert all(cell["count"] > 0 for cell in cells)
+        assert_cells_equal(cells, build_cube_cells(remaining))
+
+        stats = await server.get_feedback_stats(category=None, rating=None, from_day=None, to_day=None)
+        assert_stats_equal(stats.dict(), brute_force_stats(remaining))
+
+        # A rebuild from scratch lands on the same cells
+        await server.rebuild_feedback_cube()
+        assert_cells_equal(await stored_cells(db), build_cube_cells(remaining))
+
+    server_db(scenario)
+
+
+def test_concurrent_startups_rebuild_once(server_db, docs):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs])
+        await db.feedback_cube.drop()
+        # Every worker of a multi-worker deployment runs startup at once
+        await asyncio.gather(*[server.init_collections() for _ in range(4)])
+        assert_cells_equal(await stored_cells(db), build_cube_cells(docs))
+        assert await db.feedback_cube_state.find_one({"_id": "rebuild_lock"}) is None
+
+    server_db(scenario)
+
+
+def test_rebuild_endpoint_rejects_concurrent_rebuild(server_db):
+    async def scenario(db):
+        assert await server.acquire_cube_rebuild_lock() is not None
+        with pytest.raises(server.HTTPException) as error:
+            await server.rebuild_feedback_stats()
+        assert error.value.status_code == 409
+
+    server_db(scenario)
+
+
+def test_failed_rebuild_keeps_cube_stale_and_cleans_up(server_db, docs, monkeypatch):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs[:50]])
+        await server.mark_cube_stale()
+        monkeypatch.setattr(server, "CUBE_REBUILD_PIPELINE", [{"$unsupportedStage": {}}])
+        with pytest.raises(Exception):
+            await server.rebuild_feedback_cube()
+
+        assert (await db.feedback_cube_state.find_one({"_id": "cube"}))["stale"] is True
+        assert await db.feedback_cube_state.find_one({"_id": "rebuild_lock"}) is None
+        names = await db.list_collection_names()
+        assert not [name for name in names if name.startswith("feedback_cube_rebuild_")]
+
+    server_db(scenario)
+
+
+def test_successful_rebuild_clears_stale_flag(server_db, docs):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs[:50]])
+        await server.mark_cube_stale()
+        await server.rebuild_feedback_cube()
+        assert (await db.feedback_cube_state.find_one({"_id": "cube"}))["stale"] is False
+
+    server_db(scenario)
+
+
+def test_rebuild_renews_its_lock(server_db, monkeypatch):
+    async def scenario(db):
+        monkeypatch.setattr(server, "CUBE_REBUILD_LOCK_SECONDS", 0.3)
+
+        async def slow_catchup(keys):
+            # Outlive the initial lock expiry several times over
+            await asyncio.sleep(1)
+            assert await server.acquire_cube_rebuild_lock() is None
+
+        monkeypatch.setattr(server, "refresh_cube_cells", slow_catchup)
+        assert await server.rebuild_feedback_cube() == 0
+        assert await server.acquire_cube_rebuild_lock() is not None
+
+    server_db(scenario)
+
+
+def test_startup_survives_failed_rebuild(server_db, docs, monkeypatch):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs[:50]])
+        await db.feedback_cube.drop()
+        pipeline = server.CUBE_REBUILD_PIPELINE
+        monkeypatch.setattr(server, "CUBE_REBUILD_PIPELINE", [{"$unsupportedStage": {}}])
+        await server.init_collections()
+        assert (await db.feedback_cube_state.find_one({"_id": "cube"}))["stale"] is True
+
+        # The next startup repairs it
+        monkeypatch.setattr(server, "CUBE_REBUILD_PIPELINE", pipeline)
+        await server.init_collections()
+        assert_cells_equal(await stored_cells(db), build_cube_cells(docs[:50]))
+
+    server_db(scenario)
+
+
+class IngestDuringRecount:
+    """Database proxy that stores another feedback right after each feedback read"""
+
+    def __init__(self, db, feedback_docs):
+        self.db = db
+        self.pending = list(feedback_docs)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    @property
+    def feedback(self):
+        proxy = self
+
+        class Cursor:
+            def __init__(self, cursor):
+                self.cursor = cursor
+
+            async def to_list(self, length):
+                docs = await self.cursor.to_list(length)
+                if proxy.pending:
+                    feedback = proxy.pending.pop()
+                    await proxy.db.feedback.insert_one(dict(feedback))
+                    await server.update_feedback_cube(feedback)
+                return docs
+
+        class Feedback:
+            def __getattr__(self, name):
+                return getattr(proxy.db.feedback, name)
+
+            def find(self, *args, **kwargs):
+                return Cursor(proxy.db.feedback.find(*args, **kwargs))
+
+        return Feedback()
+
+
+def same_cell_copies(feedback, n):
+    return [
+        dict(feedback, id=str(uuid.uuid4()), customer_email=f"same.cell.{i}@email.com")
+        for i in range(n)
+    ]
+
+
+def test_recount_retries_when_an_increment_lands_mid_read(server_db, docs, monkeypatch):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs[:50]])
+        await server.rebuild_feedback_cube()
+        monkeypatch.setattr(server, "db", IngestDuringRecount(db, same_cell_copies(docs[0], 1)))
+
+        await server.refresh_cube_cells([cube_cell_key(docs[0])])
+
+        stored = await db.feedback.find().to_list(None)
+        assert len(stored) == 51
+        assert_cells_equal(await stored_cells(db), build_cube_cells(stored))
+        assert not (await db.feedback_cube_state.find_one({"_id": "cube"})).get("stale")
+
+    server_db(scenario)
+
+
+def test_recount_marks_cube_stale_when_cell_keeps_changing(server_db, docs, monkeypatch):
+    async def scenario(db):
+        await db.feedback.insert_many([dict(d) for d in docs[:50]])
+        await server.rebuild_feedback_cube()
+        monkeypatch.setattr(server, "CUBE_REFRESH_ATTEMPTS", 3)
+        monkeypatch.setattr(server, "db", IngestDuringRecount(db, same_cell_copies(docs[0], 3)))
+
+        await server.refresh_cube_cells([cube_cell_key(docs[0])])
+
+        # Every recount was discarded, so no increment was overwritten
+        stored = await db.feedback.find().to_list(None)
+        assert len(stored) == 53
+        assert_cells_equal(await stored_cells(db), build_cube_cells(stored))
+        assert (await db.feedback_cube_state.find_one({"_id": "cube"}))["stale"] is True
+
+    server_db(scenario)
@@ -0,0 +1,402 @@
+"""
+Idempotent submission tests: retried POST /api/feedback requests must
+return the original Feedback without a second insert.
+"""
+
+import asyncio
+import sys
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from server import (  # noqa: E402
+    IDEMPOTENCY_LEASE_SECONDS,
+    IDEMPOTENCY_WINDOW_SECONDS,
+    FeedbackCategory,
+    FeedbackCreate,
+    FeedbackNotStored,
+    IdempotencyCache,
+    content_idempotency_key,
+    feedback_request_hash,
+)
+
+RACING_REQUESTS = 1000
+
+
+def make_request(**overrides):
+    data = {
+        "customer_name": "Retry Tester",
+        "customer_email": "retry.tester@email.com",
+        "category": FeedbackCategory.SUPPORT,
+        "rating": 2,
+        "comment": "Support was slow and disappointing",
+    }
+    data.update(overrides)
+    return FeedbackCreate(**data)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_evicts_least_recently_used():
+    cache = IdempotencyCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_cache_expires_entries():
+    clock = FakeClock()
+    cache = IdempotencyCache(max_size=10, ttl_seconds=60, clock=clock)
+    cache.set("a", 1)
+    clock.now = 60
+    assert cache.get("a") == 1
+    clock.now = 61
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cache_entries_can_expire_early():
+    clock = FakeClock()
+    cache = IdempotencyCache(max_size=10, ttl_seconds=60, clock=clock)
+    cache.set("a", 1, ttl_seconds=10)
+    cache.set("b", 2)
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_content_key_ignores_case_and_whitespace():
+    original = make_request()
+    retried = make_request(customer_email="  Retry.Tester@Email.com ", comment="Support was slow and disappointing\n")
+    assert content_idempotency_key(original) == content_idempotency_key(retried)
+
+
+def test_content_key_changes_with_content():
+    key = content_idempotency_key(make_request())
+    assert content_idempotency_key(make_request(comment="Great support")) != key
+    assert content_idempotency_key(make_request(category=FeedbackCategory.SERVICE)) != key
+    assert content_idempotency_key(make_request(customer_email="other@email.com")) != key
+
+
+def test_request_hash_covers_whole_body():
+    assert feedback_request_hash(make_request()) == feedback_request_hash(make_request())
+    assert feedback_request_hash(make_request()) != feedback_request_hash(make_request(rating=3))
+
+
+@pytest.fixture
+def sentiment_calls(monkeypatch):
+    """Record every sentiment analysis the server runs"""
+    calls = []
+    analyze_sentiment = server.analyze_sentiment
+
+    def counting_sentiment(text):
+        calls.append(text)
+        return analyze_sentiment(text)
+
+    monkeypatch.setattr(server, "analyze_sentiment", counting_sentiment)
+    return calls
+
+
+@pytest.fixture
+def fast_wait(monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_WAIT_SECONDS", 0.3)
+
+
+async def race(request, idempotency_key=None):
+    return await asyncio.gather(*[
+        server.create_feedback(request, idempotency_key=idempotency_key)
+        for _ in range(RACING_REQUESTS)
+    ])
+
+
+async def submit(key, request=None, create=None):
+    request = request or make_request()
+    create = create or (lambda feedback_id: server.insert_feedback(request, feedback_id))
+    return await server.submission_deduplicator.submit(key, feedback_request_hash(request), create)
+
+
+async def age_claim(db, key, seconds):
+    claim = await db.feedback_idempotency.find_one({"_id": key})
+    await db.feedback_idempotency.update_one({"_id": key}, {"$set": {
+        "created_at": claim["created_at"] - timedelta(seconds=seconds),
+        "claimed_at": claim["claimed_at"] - timedelta(seconds=seconds),
+    }})
+
+
+@pytest.mark.parametrize("idempotency_key", [str(uuid.uuid4()), None])
+@pytest.mark.parametrize("workers", [RACING_REQUESTS, 10])
+def test_racing_workers_insert_once(server_db, sentiment_calls, new_worker, idempotency_key, workers):
+    """Every racer group has its own cache and pending map, so only the Mongo claim can stop duplicates"""
+    request = make_request()
+    key, request_hash, window_seconds = server.submission_identity(request, idempotency_key)
+    creates = []
+
+    async def create(feedback_id):
+        creates.append(feedback_id)
+        # Leave the claim without feedback for a moment, as a real write would
+        await asyncio.sleep(0.01)
+        return await server.insert_feedback(request, feedback_id)
+
+    async def scenario(db):
+        pool = [new_worker() for _ in range(workers)]
+        results = await asyncio.gather(*[
+            pool[i % workers].submit(key, request_hash, create, window_seconds)
+            for i in range(RACING_REQUESTS)
+        ])
+        assert await db.feedback.count_documents({}) == 1
+        assert await db.feedback_idempotency.count_documents({}) == 1
+        assert len({feedback.id for feedback in results}) == 1
+        cells = await db.feedback_cube.find().to_list(None)
+        assert [cell["count"] for cell in cells] == [1]
+
+    server_db(scenario)
+    assert len(creates) == 1
+    assert len(sentiment_calls) == 1
+
+
+@pytest.mark.parametrize("idempotency_key", [str(uuid.uuid4()), None])
+def test_racing_requests_in_one_worker_insert_once(server_db, sentiment_calls, idempotency_key):
+    async def scenario(db):
+        results = await race(make_request(), idempotency_key)
+        assert await db.feedback.count_documents({}) == 1
+        assert len({feedback.id for feedback in results}) == 1
+        cells = await db.feedback_cube.find().to_list(None)
+        assert [cell["count"] for cell in cells] == [1]
+
+    server_db(scenario)
+    assert len(sentiment_calls) == 1
+
+
+def test_retry_from_another_worker_returns_original(server_db, sentiment_calls, new_worker):
+    async def scenario(db):
+        key = str(uuid.uuid4())
+        original = await server.create_feedback(make_request(), idempotency_key=key)
+        # A second worker has none of this process's cache
+        server.submission_deduplicator = new_worker()
+        retried = await server.create_feedback(make_request(), idempotency_key=key)
+        assert retried.id == original.id
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+    assert len(sentiment_calls) == 1
+
+
+def test_reused_key_with_different_body_is_rejected(server_db, new_worker):
+    async def scenario(db):
+        key = str(uuid.uuid4())
+        await server.create_feedback(make_request(), idempotency_key=key)
+        with pytest.raises(HTTPException) as error:
+            await server.create_feedback(make_request(rating=5), idempotency_key=key)
+        assert error.value.status_code == 422
+        server.submission_deduplicator = new_worker()
+        with pytest.raises(HTTPException) as error:
+            await server.create_feedback(make_request(rating=5), idempotency_key=key)
+        assert error.value.status_code == 422
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+
+
+def test_failed_cube_update_keeps_stored_feedback(server_db, sentiment_calls, new_worker, monkeypatch):
+    async def failing_cube_update(feedback, sign=1):
+        raise AutoReconnect("connection reset")
+
+    async def scenario(db):
+        monkeypatch.setattr(server, "update_feedback_cube", failing_cube_update)
+        original = await server.create_feedback(make_request(), idempotency_key="cube-down")
+        server.submission_deduplicator = new_worker()
+        retried = await server.create_feedback(make_request(), idempotency_key="cube-down")
+        assert retried.id == original.id
+        assert await db.feedback.count_documents({}) == 1
+        assert (await db.feedback_cube_state.find_one({"_id": "cube"}))["stale"] is True
+
+    server_db(scenario)
+    assert len(sentiment_calls) == 1
+
+
+def test_mismatched_request_does_not_fail_concurrent_retries(server_db, new_worker):
+    async def scenario(db):
+        key = str(uuid.uuid4())
+        original = await server.create_feedback(make_request(), idempotency_key=key)
+
+        # On a worker without the cached result, a reused key with another
+        # body arrives just before a genuine retry
+        server.submission_deduplicator = new_worker()
+        mismatched, retried = await asyncio.gather(
+            server.create_feedback(make_request(rating=3), idempotency_key=key),
+            server.create_feedback(make_request(), idempotency_key=key),
+            return_exceptions=True,
+        )
+        assert isinstance(mismatched, HTTPException) and mismatched.status_code == 422
+        assert retried.id == original.id
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+
+
+def test_ambiguous_write_that_landed_is_not_repeated(server_db, sentiment_calls, new_worker):
+    async def stored_then_timed_out(feedback_id):
+        await server.insert_feedback(make_request(), feedback_id)
+        raise AutoReconnect("timed out waiting for the write acknowledgement")
+
+    async def scenario(db):
+        with pytest.raises(AutoReconnect):
+            await submit("ambiguous", create=stored_then_timed_out)
+        server.submission_deduplicator = new_worker()
+        await submit("ambiguous")
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+    assert len(sentiment_calls) == 1
+
+
+def test_abandoned_claim_is_taken_over_after_lease(server_db, new_worker, fast_wait):
+    async def crashed(feedback_id):
+        raise AutoReconnect("worker lost its connection before writing")
+
+    async def scenario(db):
+        with pytest.raises(AutoReconnect):
+            await submit("abandoned", create=crashed)
+        claim = await db.feedback_idempotency.find_one({"_id": "abandoned"})
+
+        # Within the lease the owner may still be writing
+        server.submission_deduplicator = new_worker()
+        with pytest.raises(HTTPException) as error:
+            await submit("abandoned")
+        assert error.value.status_code == 409
+
+        await age_claim(db, "abandoned", IDEMPOTENCY_LEASE_SECONDS + 1)
+        feedback = await submit("abandoned")
+        assert feedback.id == claim["feedback_id"]
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+
+
+def test_late_write_of_previous_owner_is_not_duplicated(server_db, new_worker):
+    async def crashed(feedback_id):
+        raise AutoReconnect("worker lost its connection")
+
+    async def scenario(db):
+        with pytest.raises(AutoReconnect):
+            await submit("late", create=crashed)
+        await age_claim(db, "late", IDEMPOTENCY_LEASE_SECONDS + 1)
+
+        async def racing_late_write(feedback_id):
+            # The previous owner's write lands right before the new owner's
+            await server.insert_feedback(make_request(), feedback_id)
+            return await server.insert_feedback(make_request(), feedback_id)
+
+        server.submission_deduplicator = new_worker()
+        await submit("late", create=racing_late_write)
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+
+
+def test_definite_failure_releases_claim(server_db):
+    async def rejected(feedback_id):
+        raise FeedbackNotStored(feedback_id)
+
+    async def scenario(db):
+        with pytest.raises(HTTPException) as error:
+            await submit("rejected", create=rejected)
+        assert error.value.status_code == 500
+        assert await db.feedback_idempotency.find_one({"_id": "rejected"}) is None
+
+        await submit("rejected")
+        assert await db.feedback.count_documents({}) == 1
+
+    server_db(scenario)
+
+
+def test_waiter_claims_key_released_by_failed_owner(server_db):
+    async def scenario(db):
+        # Another worker holds a fresh claim and has not written yet
+        now = server.mongo_utcnow()
+        await db.feedback_idempotency.insert_one({
+            "_id": "released", "feedback_id": str(uuid.uuid4()), "request_hash": None,
+            "created_at": now, "claimed_at": now,
+        })
+        waiter = asyncio.ensure_future(submit("released"))
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+        # ...then its insert fails for sure and it releases the claim
+        await db.feedback_idempotency.delete_one({"_id": "released"})
+        feedback = await asyncio.wait_for(waiter, 2)
+        assert await db.feedback.count_documents({"id": feedback.id}) == 1
+
+    server_db(scenario)
+
+
+@pytest.mark.parametrize("age, duplicate", [
+    (IDEMPOTENCY_WINDOW_SECONDS - 2, True),
+    (IDEMPOTENCY_WINDOW_SECONDS + 1, False),
+])
+def test_content_window_slides_from_first_submission(server_db, new_worker, age, duplicate):
+    async def scenario(db):
+        original = await server.create_feedback(make_request(), idempotency_key=None)
+        # Age the first submission, e.g. sent at 4:58 and retried at 5:00+
+        await age_claim(db, content_idempotency_key(make_request()), age)
+        server.submission_deduplicator = new_worker()
+        retried = await server.create_feedback(make_request(), idempotency_key=None)
+        assert (retried.id == original.id) is duplicate
+        assert await db.feedback.count_documents({}) == (1 if duplicate else 2)
+
+        # The new submission opens its own window
+        again = await server.create_feedback(make_request(), idempotency_key=None)
+        assert again.id == retried.id
+
+    server_db(scenario)
+
+
+@pytest.mark.parametrize("idempotency_key", [str(uuid.uuid4()), None])
+def test_retry_after_delete_returns_original(server_db, sentiment_calls, new_worker, idempotency_key):
+    async def scenario(db):
+        key, _, _ = server.submission_identity(make_request(), idempotency_key)
+        first_worker = server.submission_deduplicator
+        original = await server.create_feedback(make_request(), idempotency_key=idempotency_key)
+
+        server.submission_deduplicator = new_worker()
+        await server.delete_feedback(original.id)
+        # The claim outlives the feedback until its TTL
+        assert await db.feedback_idempotency.count_documents({"_id": key}) == 1
+
+        # A late retry neither recreates the deleted feedback on the worker
+        # that cached it nor on one that only finds the claim
+        for worker in [first_worker, new_worker()]:
+            server.submission_deduplicator = worker
+            retried = await server.create_feedback(make_request(), idempotency_key=idempotency_key)
+            assert retried.id == original.id
+        assert await db.feedback.count_documents({}) == 0
+
+    server_db(scenario)
+    assert len(sentiment_calls) == 1
+
+
+def test_cache_hits_skip_the_database(server_db, monkeypatch):
+    async def scenario(db):
+        key = str(uuid.uuid4())
+        original = await server.create_feedback(make_request(), idempotency_key=key)
+        monkeypatch.setattr(server, "db", None)
+        assert await server.create_feedback(make_request(), idempotency_key=key) is original
+
+    server_db(scenario)